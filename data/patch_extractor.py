@@ -30,7 +30,7 @@ def pad_image(img, pad, mode='reflect'):
         return np.pad(img, ((pad[0], pad[1]), (pad[2], pad[3])), mode)
     else:
         h, w, c = img.shape
-        pad_img = np.zeros((h + pad[0] + pad[1], w + pad[2] + pad[3], c))
+        pad_img = np.zeros((h + pad[0] + pad[1], w + pad[2] + pad[3], c), dtype=img.dtype)
         for i in range(c):
             pad_img[:, :, i] = np.pad(img[:, :, i], ((pad[0], pad[1]), (pad[2], pad[3])), mode)
     return pad_img
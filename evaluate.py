@@ -5,10 +5,13 @@
 
 # Built-in
 import os
+import argparse
 
 # Libs
 import albumentations as A
-from albumentations.pytorch import ToTensorV2
+
+# PyTorch
+import torch
 
 # Own modules
 from mrs_utils import misc_utils, eval_utils
@@ -23,7 +26,16 @@ DATA_DIR = r'/home/wh145/mnih'
 PATCHS_SIZE = (512, 512)
 
 
+def read_flags():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--engine', type=str, default=None,
+                        help='path to a TensorRT engine built by export_trt.py, the checkpoint is used if not given')
+    parser.add_argument('--batch', type=int, default=8, help='max #images, augmented copies included, in one forward pass')
+    return parser.parse_args()
+
+
 def main():
+    flags = read_flags()
     device, _ = misc_utils.set_gpu(GPU)
 
     # init model
@@ -31,23 +43,29 @@ def main():
     model = network_io.create_model(args)
     if LOAD_EPOCH:
         args['trainer']['epochs'] = LOAD_EPOCH
-    ckpt_dir = os.path.join(MODEL_DIR, 'epoch-{}.pth.tar'.format(args['trainer']['epochs']))
-    network_utils.load(model, ckpt_dir)
-    print('Loaded from {}'.format(ckpt_dir))
-    model.to(device)
-    model.eval()
+    if flags.engine:
+        model = network_utils.TRTModule(flags.engine, model.lbl_margin, device)
+        print('Loaded TensorRT engine from {}'.format(flags.engine))
+    else:
+        ckpt_dir = os.path.join(MODEL_DIR, 'epoch-{}.pth.tar'.format(args['trainer']['epochs']))
+        network_utils.load(model, ckpt_dir)
+        print('Loaded from {}'.format(ckpt_dir))
+        model.to(device, memory_format=torch.channels_last)
+        model.eval()
+        model = network_utils.compile_model(model)
 
     # eval on dataset
     mean = (0.485, 0.456, 0.406)
     std = (0.229, 0.224, 0.225)
     tsfm_valid = A.Compose([
-        A.Normalize(mean=mean, std=std),
-        ToTensorV2(),
+        network_io.ToTensorHWC(),
     ])
     save_dir = os.path.join(r'/home/wh145/results/mrs/mass_roads', os.path.basename(network_utils.unique_model_name(args)))
-    evaluator = eval_utils.Evaluator('mnih', DATA_DIR, tsfm_valid, device)
-    evaluator.evaluate(model, PATCHS_SIZE, 2*model.lbl_margin,
-                       pred_dir=save_dir, report_dir=save_dir)
+    evaluator = eval_utils.Evaluator('mnih', DATA_DIR, tsfm_valid, device, mean=mean, std=std,
+                                     permute_on_device=True)
+    with torch.cuda.amp.autocast():
+        evaluator.evaluate(model, PATCHS_SIZE, 2*model.lbl_margin,
+                           pred_dir=save_dir, report_dir=save_dir, patch_batch_size=flags.batch)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,116 @@
+"""
+Export a trained model to ONNX and compile it into a TensorRT engine that can be used by evaluate.py
+"""
+
+
+# Built-in
+import os
+import subprocess
+
+# PyTorch
+import torch
+from torch import nn
+
+# Own modules
+from mrs_utils import misc_utils
+from network import network_io, network_utils
+
+
+# Settings
+GPU = 0
+MODEL_DIR = r'/home/wh145/models/ecvgg16_dcunet_dsmnih_lre1e-03_lrd1e-02_ep80_bs5_ds50_dr0p1'
+LOAD_EPOCH = 80
+PATCHS_SIZE = (512, 512)
+OPT_BATCH = 8
+MAX_BATCH = 16
+
+
+class InferenceWrapper(nn.Module):
+    """
+    Expose model.inference as forward, so that only the prediction map ends up in the exported graph
+    """
+    def __init__(self, model):
+        super(InferenceWrapper, self).__init__()
+        self.model = model
+
+    def forward(self, x):
+        return self.model.inference(x)
+
+
+def export_onnx(model, onnx_path, patch_size, device, opset_version=13):
+    """
+    Export the model to ONNX with a dynamic batch dimension
+    :param model: the model created by classes defined in network/
+    :param onnx_path: absolute path to the exported onnx file
+    :param patch_size: the size of the input patch
+    :param device: the device to trace the model on
+    :param opset_version: ONNX opset version, 13 is the highest one supported by torch 1.9
+    :return:
+    """
+    dummy_input = torch.randn(1, 3, *patch_size, device=device)
+    torch.onnx.export(InferenceWrapper(model).eval(), dummy_input, onnx_path, opset_version=opset_version,
+                      input_names=['x'], output_names=['y'], dynamic_axes={'x': {0: 'B'}, 'y': {0: 'B'}})
+    print('Exported ONNX model to {}'.format(onnx_path))
+
+
+def trt_supports_bf16():
+    """
+    Check if the installed TensorRT is new enough for trtexec --bf16, which is only available since TensorRT 9
+    :return: True if bf16 engines can be built
+    """
+    try:
+        import tensorrt as trt
+    except ImportError:
+        return False
+    return int(trt.__version__.split('.')[0]) >= 9
+
+
+def build_engine(onnx_path, engine_path, patch_size, opt_batch, max_batch, use_bf16=False):
+    """
+    Compile the ONNX model into a TensorRT engine with trtexec
+    :param onnx_path: absolute path to the onnx file
+    :param engine_path: absolute path to the engine file to save
+    :param patch_size: the size of the input patch
+    :param opt_batch: the batch size TensorRT optimizes for
+    :param max_batch: the largest batch size the engine accepts
+    :param use_bf16: if True, build with bf16 kernels, otherwise fp16
+    :return:
+    """
+    shape_str = 'x:{}x3x{}x{}'
+    cmd = [
+        'trtexec',
+        '--onnx={}'.format(onnx_path),
+        '--saveEngine={}'.format(engine_path),
+        '--bf16' if use_bf16 else '--fp16',
+        '--minShapes={}'.format(shape_str.format(1, *patch_size)),
+        '--optShapes={}'.format(shape_str.format(opt_batch, *patch_size)),
+        '--maxShapes={}'.format(shape_str.format(max_batch, *patch_size)),
+    ]
+    subprocess.run(cmd, check=True)
+    print('Saved TensorRT engine at {}'.format(engine_path))
+
+
+def main():
+    device, _ = misc_utils.set_gpu(GPU)
+
+    # init model
+    args = network_io.load_config(MODEL_DIR)
+    model = network_io.create_model(args)
+    if LOAD_EPOCH:
+        args['trainer']['epochs'] = LOAD_EPOCH
+    ckpt_dir = os.path.join(MODEL_DIR, 'epoch-{}.pth.tar'.format(args['trainer']['epochs']))
+    network_utils.load(model, ckpt_dir)
+    print('Loaded from {}'.format(ckpt_dir))
+    model.to(device)
+    model.eval()
+
+    # export & compile, bf16 needs an Ampere or newer GPU and TensorRT >= 9, otherwise fall back to fp16
+    onnx_path = os.path.join(MODEL_DIR, 'epoch-{}.onnx'.format(args['trainer']['epochs']))
+    engine_path = os.path.join(MODEL_DIR, 'epoch-{}.plan'.format(args['trainer']['epochs']))
+    use_bf16 = torch.cuda.get_device_capability(device)[0] >= 8 and trt_supports_bf16()
+    export_onnx(model, onnx_path, PATCHS_SIZE, device)
+    build_engine(onnx_path, engine_path, PATCHS_SIZE, OPT_BATCH, MAX_BATCH, use_bf16)
+
+
+if __name__ == '__main__':
+    main()
@@ -331,10 +331,21 @@ def get_precision_recall(conf, true):
 
 
 class Evaluator:
-    def __init__(self, ds_name, data_dir, tsfm, device, load_func=None, infer=False, ensembler=None, **kwargs):
+    def __init__(self, ds_name, data_dir, tsfm, device, load_func=None, infer=False, ensembler=None, mean=None,
+                 std=None, permute_on_device=False, **kwargs):
         ds_name = misc_utils.stem_string(ds_name)
         self.tsfm = tsfm
         self.device = device
+        # stack patches straight into pinned memory so that they are copied to the gpu with a single dma transfer
+        self.pin_memory = torch.device(device).type == 'cuda'
+        # if True, tsfm keeps patches in H*W*C (e.g. network_io.ToTensorHWC) and they are permuted on the device
+        self.permute_on_device = permute_on_device
+        # if mean and std are given, patches are normalized on the device instead of in tsfm
+        if mean is not None and std is not None:
+            self.mean = torch.tensor(mean, device=device).view(1, 3, 1, 1) * 255
+            self.inv_std = 1 / (torch.tensor(std, device=device).view(1, 3, 1, 1) * 255)
+        else:
+            self.mean, self.inv_std = None, None
         if ensembler is None:
             self.ensembler = BaseEnsemble()
         else:
@@ -412,7 +423,7 @@ class Evaluator:
         return print_string, report_string
 
     def evaluate(self, model, patch_size, overlap, pred_dir=None, report_dir=None, save_conf=False, delta=1e-6,
-                 eval_class=(1, ), visualize=False, densecrf=False, crf_params=None, verbose=True):
+                 eval_class=(1, ), visualize=False, densecrf=False, crf_params=None, verbose=True, patch_batch_size=1):
         if isinstance(model, list) or isinstance(model, tuple):
             lbl_margin = model[0].lbl_margin
         else:
@@ -441,9 +452,11 @@ class Evaluator:
             if isinstance(model, list) or isinstance(model, tuple):
                 tile_preds = 0
                 for m in model:
-                    tile_preds = tile_preds + self.infer_tile(m, rgb, grid_list, patch_size, tile_dim, tile_dim_pad, lbl_margin)
+                    tile_preds = tile_preds + self.infer_tile(m, rgb, grid_list, patch_size, tile_dim, tile_dim_pad,
+                                                              lbl_margin, patch_batch_size)
             else:
-                tile_preds = self.infer_tile(model, rgb, grid_list, patch_size, tile_dim, tile_dim_pad, lbl_margin)
+                tile_preds = self.infer_tile(model, rgb, grid_list, patch_size, tile_dim, tile_dim_pad, lbl_margin,
+                                             patch_batch_size)
 
             if save_conf:
                 misc_utils.save_file(os.path.join(pred_dir, '{}.npy'.format(file_name)), tile_preds[:, :, 1])
@@ -483,18 +496,57 @@ class Evaluator:
             misc_utils.save_file(os.path.join(report_dir, 'result.txt'), report)
         return np.mean(iou_a / (iou_b + delta))*100
 
-    def infer_tile(self, model, rgb, grid_list, patch_size, tile_dim, tile_dim_pad, lbl_margin):
+    def _infer_batch(self, model, batch, batch_cnt, patch_batch_size):
+        """
+        Run forwards on a batch of augmented patches and fuse the predictions of each patch
+        :param model: the model to run
+        :param batch: list of transformed patches, augmented copies of one patch are next to each other
+        :param batch_cnt: list of #augmented copies for each patch in the batch
+        :param patch_batch_size: the max #images in one forward pass
+        :return: list of fused predictions, one per patch, in channel last format
+        """
+        # augmented copies could have different sizes, e.g. MultiResEnsemble, only stack patches with the same shape
+        preds = [None for _ in batch]
+        for shape in set(tuple(a.shape) for a in batch):
+            shape_ind = [i for i, a in enumerate(batch) if tuple(a.shape) == shape]
+            for start in range(0, len(shape_ind), patch_batch_size):
+                batch_ind = shape_ind[start:start+patch_batch_size]
+                # torch allocates pinned memory through a caching allocator, so the buffer is reused across chunks
+                out = torch.empty((len(batch_ind),) + shape, dtype=batch[batch_ind[0]].dtype,
+                                  pin_memory=self.pin_memory)
+                image = torch.stack([batch[i] for i in batch_ind], 0, out=out).to(self.device)
+                if self.permute_on_device:
+                    image = image.permute(0, 3, 1, 2).contiguous(memory_format=torch.channels_last)
+                if self.mean is not None:
+                    image = (image.float() - self.mean) * self.inv_std
+                pred = F.softmax(model.inference(image), 1).cpu().numpy()
+                for cnt, i in enumerate(batch_ind):
+                    preds[i] = pred[cnt:cnt+1]
+        fused_preds = []
+        start = 0
+        for cnt in batch_cnt:
+            patch_preds = preds[start:start+cnt]
+            fused_preds.append(data_utils.change_channel_order(self.ensembler.fuse_data(patch_preds), True)[0, :, :, :])
+            start += cnt
+        return fused_preds
+
+    def infer_tile(self, model, rgb, grid_list, patch_size, tile_dim, tile_dim_pad, lbl_margin, patch_batch_size=1):
         tile_preds = []
-        for patch in patch_extractor.patch_block(rgb, model.lbl_margin, grid_list, patch_size, False):
-            patch_preds = []
-            for aug_patch in self.ensembler.augment_data(patch):
-                for tsfm in self.tsfm:
-                    tsfm_image = tsfm(image=aug_patch)
-                    aug_patch = tsfm_image['image']
-                aug_patch = torch.unsqueeze(aug_patch, 0).to(self.device)
-                pred = F.softmax(model.inference(aug_patch), 1).detach().cpu().numpy()
-                patch_preds.append(pred)
-            tile_preds.append(data_utils.change_channel_order(self.ensembler.fuse_data(patch_preds), True)[0, :, :, :])
+        batch, batch_cnt = [], []
+        with torch.inference_mode():
+            for patch in patch_extractor.patch_block(rgb, model.lbl_margin, grid_list, patch_size, False):
+                aug_patches = self.ensembler.augment_data(patch)
+                for aug_patch in aug_patches:
+                    for tsfm in self.tsfm:
+                        tsfm_image = tsfm(image=aug_patch)
+                        aug_patch = tsfm_image['image']
+                    batch.append(aug_patch)
+                batch_cnt.append(len(aug_patches))
+                if len(batch) >= patch_batch_size:
+                    tile_preds.extend(self._infer_batch(model, batch, batch_cnt, patch_batch_size))
+                    batch, batch_cnt = [], []
+            if len(batch) > 0:
+                tile_preds.extend(self._infer_batch(model, batch, batch_cnt, patch_batch_size))
         # stitch back to tiles
         tile_preds = patch_extractor.unpatch_block(
             np.array(tile_preds),
@@ -507,7 +559,7 @@ class Evaluator:
         return tile_preds
 
     def infer(self, model, pred_dir, patch_size, overlap, ext='_mask', file_ext='png', visualize=False,
-              densecrf=False, crf_params=None):
+              densecrf=False, crf_params=None, patch_batch_size=1):
         if isinstance(model, list) or isinstance(model, tuple):
             lbl_margin = model[0].lbl_margin
         else:
@@ -532,9 +584,10 @@ class Evaluator:
                 tile_preds = 0
                 for m in model:
                     tile_preds = tile_preds + self.infer_tile(m, rgb, grid_list, patch_size, tile_dim, tile_dim_pad,
-                                                              lbl_margin)
+                                                              lbl_margin, patch_batch_size)
             else:
-                tile_preds = self.infer_tile(model, rgb, grid_list, patch_size, tile_dim, tile_dim_pad, lbl_margin)
+                tile_preds = self.infer_tile(model, rgb, grid_list, patch_size, tile_dim, tile_dim_pad, lbl_margin,
+                                             patch_batch_size)
 
             if densecrf:
                 d = dcrf.DenseCRF2D(*tile_preds.shape)
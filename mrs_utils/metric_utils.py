@@ -38,12 +38,13 @@ class LossClass(nn.Module):
 
     def update(self, loss, size):
         """
-        Update the current loss tracker
+        Update the current loss tracker, the loss is accumulated on its device so that there is no synchronization
+        until get_loss is called
         :param loss: the computed loss
         :param size: #elements in the batch
         :return:
         """
-        self.loss += loss.item() * size
+        self.loss = self.loss + loss.detach().float() * size
         self.cnt += 1
 
     def reset(self):
@@ -59,7 +60,7 @@ class LossClass(nn.Module):
         Get mean loss within this epoch
         :return:
         """
-        return self.loss / self.cnt
+        return float(self.loss) / self.cnt
 
 
 class LossMeter(LossClass):
@@ -190,15 +191,15 @@ class IoU(LossClass):
             return intersect, union
 
     def update(self, loss, size):
-        self.numerator += loss[0].item() * size
-        self.denominator += loss[1].item() * size
+        self.numerator = self.numerator + loss[0].detach() * size
+        self.denominator = self.denominator + loss[1].detach() * size
 
     def reset(self):
         self.numerator = 0
         self.denominator = 0
 
     def get_loss(self):
-        return self.numerator / (self.denominator + self.delta)
+        return float(self.numerator) / (float(self.denominator) + self.delta)
 
 
 class FocalLoss(LossClass):
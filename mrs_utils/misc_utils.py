@@ -435,6 +435,10 @@ def historical_process_flag(flags):
         flags['trainer']['further_train'] = False
     elif isinstance(flags['trainer']['further_train'], str):
         flags['trainer']['further_train'] = eval(flags['trainer']['further_train'])
+    if 'use_amp' not in flags['trainer']:
+        flags['trainer']['use_amp'] = False
+    elif isinstance(flags['trainer']['use_amp'], str):
+        flags['trainer']['use_amp'] = eval(flags['trainer']['use_amp'])
     if 'use_emau' not in flags:
         flags['use_emau'] = False
     elif isinstance(flags['use_emau'], str):
@@ -9,6 +9,10 @@ import matplotlib.pyplot as plt
 # Own modules
 from data import data_utils
 
+# Settings
+# #samples of a batch shown in the tensorboard banner
+TB_BANNER_NUM = 4
+
 
 def get_default_colors():
     """
@@ -12,17 +12,26 @@ from tqdm import tqdm
 # PyTorch
 import torch
 from torch import nn
-from torch.autograd import Variable
 
 # Own modules
 from mrs_utils import vis_utils
 from network import network_utils
 
+# let matmul and convolution use TF32 tensor cores on Ampere or newer GPUs
+torch.backends.cuda.matmul.allow_tf32 = True
+torch.backends.cudnn.allow_tf32 = True
+if hasattr(torch, 'set_float32_matmul_precision'):
+    torch.set_float32_matmul_precision('high')
+
 
 class Base(nn.Module):
     def __init__(self):
         self.lbl_margin = 0
         super(Base, self).__init__()
+        self.grad_scaler = None
+        self._conv_layers = None
+        self._lw_key = None
+        self._lw_dict = None
 
     def forward(self, *inputs_):
         """
@@ -40,15 +49,26 @@ class Base(nn.Module):
         else:
             return outputs
 
+    @property
+    def conv_layers(self):
+        """
+        All the conv layers in the model, the list is built on the first access and reused afterwards
+        :return:
+        """
+        if self._conv_layers is None:
+            self._conv_layers = [m for m in self.modules() if isinstance(m, nn.Conv2d)]
+        return self._conv_layers
+
     def init_weight(self):
         """
         Initialize weights of the model
         :return:
         """
-        for m in network_utils.iterate_sublayers(self):
-            if isinstance(m, nn.Conv2d):
-                torch.nn.init.xavier_uniform(m.weight)
-                torch.nn.init.xavier_uniform(m.bias)
+        with torch.no_grad():
+            for m in self.conv_layers:
+                torch.nn.init.xavier_uniform_(m.weight)
+                if m.bias is not None:
+                    torch.nn.init.zeros_(m.bias)
 
     def set_train_params(self, learn_rate, **kwargs):
         """
@@ -69,74 +89,101 @@ class Base(nn.Module):
                 {'params': self.decoder.parameters(), 'lr': learn_rate[1]}
             ]
 
+    def _normalize_loss_weights(self, bp_loss_idx, loss_weights):
+        """
+        Normalize the loss weights to sum up to 1 and map them to the criterion indices
+        The result is cached on the model as the arguments stay the same between epochs
+        :param bp_loss_idx: indices of the criterions to back propagate
+        :param loss_weights: weights of the back propagated criterions, if None, all of them will be weighted by 1
+        :return: a dictionary of criterion index and weight pairs
+        """
+        lw_key = (tuple(bp_loss_idx), None if loss_weights is None else tuple(loss_weights))
+        if self._lw_key != lw_key:
+            if loss_weights is None:
+                self._lw_dict = {a: 1.0 for a in bp_loss_idx}
+            else:
+                assert len(loss_weights) == len(bp_loss_idx)
+                self._lw_dict = {a: b/sum(loss_weights) for (a, b) in zip(bp_loss_idx, loss_weights)}
+            self._lw_key = lw_key
+        return self._lw_dict
+
     def step(self, data_loaders, device, optm, phase, criterions, bp_loss_idx=0, save_image=True,
              mean=(0.485, 0.456, 0.406), std=(0.229, 0.224, 0.225), loss_weights=None, use_emau=False,
-             use_ocr=False, cls_criterion=None, cls_weight=0.1):
+             use_ocr=False, cls_criterion=None, cls_weight=0.1, use_amp=False, data_loader_others=None):
         """
         This function does one forward and backward path in the training
         Print necessary message
+        :param use_amp: if True, forward and loss will be computed in mixed precision with a scaled backward
+        :param data_loader_others: endless iterators over data_loaders[1:] to mix into the batch, if None, they will
+                                   be created from data_loaders in every call
         :param kwargs:
         :return:
         """
         # settings
         if isinstance(bp_loss_idx, int):
             bp_loss_idx = (bp_loss_idx,)
-        if loss_weights is None:
-            loss_weights = {a: 1.0 for a in bp_loss_idx}
-        else:
-            assert len(loss_weights) == len(bp_loss_idx)
-            loss_weights = [a/sum(loss_weights) for a in loss_weights]
-            loss_weights = {a: b for (a, b) in zip(bp_loss_idx, loss_weights)}
+        loss_weights = self._normalize_loss_weights(bp_loss_idx, loss_weights)
+        # weights of the back-propagated losses in the order they appear in criterions
+        bp_weights = torch.tensor([loss_weights[c_cnt] for c_cnt in range(len(criterions)) if c_cnt in bp_loss_idx],
+                                  device=device)
         aux_train = False
         if cls_criterion is not None:
             aux_train = True
+        # the scaler is kept on the model and in its checkpoints so that the loss scale carries on across epochs and
+        # resumed training, it is only rebuilt when mixed precision is switched on or off
+        if self.grad_scaler is None or self.grad_scaler.is_enabled() != use_amp:
+            self.grad_scaler = torch.cuda.amp.GradScaler(enabled=use_amp)
 
-        # make infi-loop data loader
+        # make infi-loop data loader if the caller does not keep them across epochs
         mix_batch = False
-        data_loader_others = []
         if len(data_loaders) > 1:
             mix_batch = True
-            for dlo in data_loaders[1:]:
-                data_loader_others.append(network_utils.infi_loop_loader(dlo))
+            if data_loader_others is None:
+                data_loader_others = [network_utils.infi_loop_loader(dlo) for dlo in data_loaders[1:]]
 
         loss_dict = {}
         for img_cnt, data_dict in enumerate(tqdm(data_loaders[0], desc='{}'.format(phase))):
             if mix_batch and phase == 'train':
-                for dlo in data_loader_others:
-                    data_dict_other = next(dlo)
-                    for key, val in data_dict.items():
-                        data_dict[key] = torch.cat([val, data_dict_other[key]], dim=0)
+                # concatenate all the batches at once instead of growing the tensor loader by loader
+                data_dict_others = [next(dlo) for dlo in data_loader_others]
+                for key, val in data_dict.items():
+                    data_dict[key] = torch.cat([val] + [d[key] for d in data_dict_others], dim=0)
 
-            image = Variable(data_dict['image'], requires_grad=True).to(device)
-            label = Variable(data_dict['mask']).long().to(device)
+            image = data_dict['image'].to(device, non_blocking=True).contiguous(memory_format=torch.channels_last)
+            label = data_dict['mask'].to(device, non_blocking=True).long()
             if aux_train:
-                cls = Variable(data_dict['cls']).to(device)
-            optm.zero_grad()
+                cls = data_dict['cls'].to(device, non_blocking=True)
+            optm.zero_grad(set_to_none=True)
 
-            # forward step
-            if phase == 'train':
+            # forward step, evaluation runs the forward and the metrics all in inference mode
+            with torch.cuda.amp.autocast(enabled=use_amp), torch.inference_mode(phase != 'train'):
                 output_dict = self.forward(image)
-            else:
-                with torch.autograd.no_grad():
-                    output_dict = self.forward(image)
-
-            # loss
-            # crop margin if necessary & reduce channel dimension
-            if self.lbl_margin > 0:
-                label = label[:, self.lbl_margin:-self.lbl_margin, self.lbl_margin:-self.lbl_margin]
-            loss_all = 0
-            for c_cnt, c in enumerate(criterions):
-                loss = c(output_dict['pred'], label)
-                # FIXME adhoc solution for OCRNet's region supervision
-                if phase == 'train' and c_cnt in bp_loss_idx:
-                    if use_ocr:
-                        loss += c(output_dict['region'], label) * 0.4
-                    loss_all += loss_weights[c_cnt] * loss
-                c.update(loss, image.size(0))
-            if aux_train:
-                aux_loss = cls_criterion(output_dict['aux'], cls)
-                loss_all += cls_weight * aux_loss
-                cls_criterion.update(aux_loss, image.size(0))
+
+                # loss
+                # crop margin if necessary & reduce channel dimension, the criterions share one contiguous label
+                if self.lbl_margin > 0:
+                    label = label[:, self.lbl_margin:-self.lbl_margin, self.lbl_margin:-self.lbl_margin].contiguous()
+                if phase == 'train':
+                    bp_losses = []
+                    for c_cnt, c in enumerate(criterions):
+                        loss = c(output_dict['pred'], label)
+                        # FIXME adhoc solution for OCRNet's region supervision
+                        if c_cnt in bp_loss_idx:
+                            if use_ocr:
+                                loss += c(output_dict['region'], label) * 0.4
+                            bp_losses.append(loss)
+                        c.update(loss, image.size(0))
+                    loss_all = (torch.stack(bp_losses) * bp_weights).sum()
+                    if aux_train:
+                        aux_loss = cls_criterion(output_dict['aux'], cls)
+                        loss_all += cls_weight * aux_loss
+                        cls_criterion.update(aux_loss, image.size(0))
+                else:
+                    # nothing to back propagate, only track the criterions for reporting
+                    for c in criterions:
+                        c.update(c(output_dict['pred'], label), image.size(0))
+                    if aux_train:
+                        cls_criterion.update(cls_criterion(output_dict['aux'], cls), image.size(0))
             if phase == 'train':
                 if use_emau:
                     with torch.no_grad():
@@ -144,15 +191,18 @@ class Base(nn.Module):
                         momentum = 0.9
                         self.encoder.emau.mu *= momentum
                         self.encoder.emau.mu += mu * (1 - momentum)
-                loss_all.backward()
-                optm.step()
+                self.grad_scaler.scale(loss_all).backward()
+                self.grad_scaler.step(optm)
+                self.grad_scaler.update()
 
             if save_image and img_cnt == 0:
-                img_image = image.detach().cpu().numpy()
+                # only the first few samples go into the banner, slice them before copying to the cpu
+                img_image = image[:vis_utils.TB_BANNER_NUM].detach()
                 if self.lbl_margin > 0:
                     img_image = img_image[:, :, self.lbl_margin: -self.lbl_margin, self.lbl_margin: -self.lbl_margin]
-                lbl_image = label.cpu().numpy()
-                pred_image = output_dict['pred'].detach().cpu().numpy()
+                img_image = img_image.contiguous().cpu().numpy()
+                lbl_image = label[:vis_utils.TB_BANNER_NUM].cpu().numpy()
+                pred_image = output_dict['pred'][:vis_utils.TB_BANNER_NUM].detach().cpu().numpy()
                 banner = vis_utils.make_tb_image(img_image, lbl_image, pred_image, self.n_class, mean, std)
                 loss_dict['image'] = torch.from_numpy(banner)
         for c in criterions:
@@ -10,6 +10,7 @@ import os
 import numpy as np
 
 # Pytorch
+import torch
 import albumentations as A
 from torch import optim
 from albumentations.pytorch import ToTensorV2
@@ -105,6 +106,21 @@ def create_optimizer(optm_name, train_params, lr):
     return optm
 
 
+class ToTensorHWC(A.ImageOnlyTransform):
+    """
+    Convert the image into a torch tensor without changing its layout or dtype, unlike ToTensorV2 the H*W*C to
+    C*H*W permute is left to be done on the device
+    """
+    def __init__(self, p=1.0):
+        super(ToTensorHWC, self).__init__(p=p)
+
+    def apply(self, img, **params):
+        return torch.from_numpy(np.ascontiguousarray(img))
+
+    def get_transform_init_args_names(self):
+        return ()
+
+
 def create_tsfm(args, mean, std, normalize=True, tsfms=None):
     """
     Create transform based on configuration
@@ -61,6 +61,20 @@ def iterate_sublayers(network):
     return all_layers
 
 
+def compile_model(model, mode='reduce-overhead'):
+    """
+    Compile the forward of the model with torch.compile if available, set MRS_NO_COMPILE=1 to opt out
+    The forward is replaced in place so that model.inference and model.lbl_margin keep working
+    :param model: the model created by classes defined in network/
+    :param mode: the torch.compile mode
+    :return: the model with compiled forward
+    """
+    if os.environ.get('MRS_NO_COMPILE', '0') == '1' or not hasattr(torch, 'compile'):
+        return model
+    model.forward = torch.compile(model.forward, mode=mode, fullgraph=False, dynamic=False)
+    return model
+
+
 def network_summary(network, input_size, **kwargs):
     """
     Make a summary of the network, could be used for debugging purpose
@@ -89,6 +103,18 @@ def load_optim(optim, state_dict, device):
                 state[k] = v.to(device)
 
 
+def load_scaler(model, checkpoint):
+    """
+    Restore the AMP gradient scaler of the model if the checkpoint was trained with mixed precision
+    :param model: the model created by classes defined in network/
+    :param checkpoint: the loaded checkpoint dictionary
+    :return:
+    """
+    if checkpoint.get('scaler_dict'):
+        model.grad_scaler = torch.cuda.amp.GradScaler()
+        model.grad_scaler.load_state_dict(checkpoint['scaler_dict'])
+
+
 def load_epoch(save_dir, resume_epoch, model, optm, device, model_key='state_dict'):
     """
     Load model from a snapshot, this function can be used to resume training
@@ -105,6 +131,7 @@ def load_epoch(save_dir, resume_epoch, model, optm, device, model_key='state_dic
         os.path.join(save_dir, 'epoch-' + str(resume_epoch) + '.pth.tar')))
     model.load_state_dict(checkpoint[model_key])
     load_optim(optm, checkpoint['opt_dict'], device)
+    load_scaler(model, checkpoint)
 
 
 def sequential_load(target, source_state):
@@ -236,6 +263,7 @@ def load(model, model_path, relax_load=False, disable_parallel=False, optm=None,
     if optm is not None:
         assert device is not None
         load_optim(optm, checkpoint['opt_dict'], device)
+        load_scaler(model, checkpoint)
 
 
 def save(model, epochs, optm, loss_dict, save_name):
@@ -248,10 +276,12 @@ def save(model, epochs, optm, loss_dict, save_name):
     :param save_name: absolute path to the file to store the model
     :return:
     """
+    grad_scaler = getattr(model, 'grad_scaler', None)
     torch.save({
         'epoch': epochs,
         'state_dict': model.state_dict(),
         'opt_dict': optm.state_dict(),
+        'scaler_dict': grad_scaler.state_dict() if grad_scaler is not None else {},
         'loss': loss_dict,
     }, save_name)
     print('Saved model at {}'.format(save_name))
@@ -336,3 +366,53 @@ def infi_loop_loader(dl):
     """
     while True:
         for x in dl: yield x
+
+
+class TRTModule(object):
+    """
+    Wrap a serialized TensorRT engine built by export_trt.py, so that it can be used in place of the model in
+    eval_utils.Evaluator
+    """
+    def __init__(self, engine_path, lbl_margin, device, input_name='x', output_name='y'):
+        """
+        :param engine_path: absolute path to the TensorRT engine file
+        :param lbl_margin: the label margin of the model the engine was exported from
+        :param device: the device the engine runs on
+        :param input_name: name of the input tensor in the engine
+        :param output_name: name of the output tensor in the engine
+        """
+        import tensorrt as trt
+        self.lbl_margin = lbl_margin
+        self.device = device
+        self.input_name = input_name
+        self.output_name = output_name
+        with open(engine_path, 'rb') as f, trt.Runtime(trt.Logger(trt.Logger.WARNING)) as runtime:
+            self.engine = runtime.deserialize_cuda_engine(f.read())
+        self.context = self.engine.create_execution_context()
+        # the largest batch allowed by the engine's optimization profile, i.e. --maxShapes in export_trt.py
+        self.max_batch = self.engine.get_tensor_profile_shape(self.input_name, 0)[2][0]
+        if self.engine.get_tensor_dtype(self.output_name) == trt.DataType.HALF:
+            self.output_dtype = torch.float16
+        else:
+            self.output_dtype = torch.float32
+
+    def forward(self, x):
+        return {'pred': self.inference(x)}
+
+    def inference(self, x):
+        x = x.to(self.device).float().contiguous()
+        if x.shape[0] > self.max_batch:
+            return torch.cat([self.inference(a) for a in torch.split(x, self.max_batch)], dim=0)
+        self.context.set_input_shape(self.input_name, tuple(x.shape))
+        y = torch.empty(tuple(self.context.get_tensor_shape(self.output_name)), dtype=self.output_dtype,
+                        device=self.device)
+        self.context.set_tensor_address(self.input_name, x.data_ptr())
+        self.context.set_tensor_address(self.output_name, y.data_ptr())
+        self.context.execute_async_v3(torch.cuda.current_stream(self.device).cuda_stream)
+        return y
+
+    def __call__(self, x):
+        return self.forward(x)
+
+    def eval(self):
+        return self
@@ -11,7 +11,6 @@ from tqdm import tqdm
 # PyTorch
 import torch
 from torch import nn
-from torch.autograd import Variable
 
 # Own modules
 from mrs_utils import misc_utils, vis_utils
@@ -27,22 +26,22 @@ class TransformLayer(nn.Module):
         for img_cnt, data_dict in enumerate(tqdm(data_loaders[0], desc='{}'.format(phase))):
             if not normalize:
                 data_dict['image'] = (data_dict['image'] / 127.5) - 1
-            image = Variable(data_dict['image'], requires_grad=True).to(device)
-            label = Variable(data_dict['mask']).long().to(device)
+            image = data_dict['image'].to(device, non_blocking=True)
+            label = data_dict['mask'].to(device, non_blocking=True).long()
 
             # forward step
             if phase == 'train':
                 image_adjust = self.forward(image)
                 output_dict = model.forward(image_adjust)
             else:
-                with torch.autograd.no_grad():
+                with torch.inference_mode():
                     image_adjust = self.forward(image)
                     output_dict = model.forward(image_adjust)
 
             # loss
             # crop margin if necessary & reduce channel dimension
             if model.lbl_margin > 0:
-                label = label[:, model.lbl_margin:-model.lbl_margin, model.lbl_margin:-model.lbl_margin]
+                label = label[:, model.lbl_margin:-model.lbl_margin, model.lbl_margin:-model.lbl_margin].contiguous()
             loss_all = 0
             for c_cnt, c in enumerate(criterions):
                 loss = c(output_dict['pred'], label)
@@ -56,14 +55,16 @@ class TransformLayer(nn.Module):
 
             # make image for tensorboard
             if img_cnt == 0:
-                img_image = image.detach().cpu().numpy()
-                image_adjust = image_adjust.detach().cpu().numpy()
+                # only the first few samples go into the banner, slice them before copying to the cpu
+                img_image = image[:vis_utils.TB_BANNER_NUM].detach()
+                image_adjust = image_adjust[:vis_utils.TB_BANNER_NUM].detach().cpu().numpy()
 
                 if model.lbl_margin > 0:
                     img_image = img_image[:, :, model.lbl_margin: -model.lbl_margin,
                                 model.lbl_margin: -model.lbl_margin]
-                lbl_image = label.cpu().numpy()
-                pred_image = output_dict['pred'].detach().cpu().numpy()
+                img_image = img_image.contiguous().cpu().numpy()
+                lbl_image = label[:vis_utils.TB_BANNER_NUM].cpu().numpy()
+                pred_image = output_dict['pred'][:vis_utils.TB_BANNER_NUM].detach().cpu().numpy()
                 banner_cmp = vis_utils.make_image_banner([img_image, image_adjust, lbl_image, pred_image],
                                                          class_num, mean, std, max_ind=(3,), decode_ind=(2, 3))
                 loss_dict['image'] = torch.from_numpy(banner_cmp)
@@ -38,6 +38,18 @@ def read_config():
     return flags
 
 
+def get_loader_kwargs(num_workers):
+    """
+    Extra DataLoader arguments that let loading the next batch overlap with the current forward pass
+    :param num_workers: #workers of the data loader, worker options are only set when there are workers
+    :return: a dictionary of DataLoader keyword arguments
+    """
+    loader_kwargs = {'num_workers': num_workers, 'pin_memory': True}
+    if num_workers > 0:
+        loader_kwargs.update({'persistent_workers': True, 'prefetch_factor': 4})
+    return loader_kwargs
+
+
 def train_model(args, device, parallel):
     """
     The function to train the model
@@ -86,7 +98,7 @@ def train_model(args, device, parallel):
 
     # prepare training
     print('Total params: {:.2f}M'.format(network_utils.get_model_size(model)))
-    model.to(device)
+    model.to(device, memory_format=torch.channels_last)
     for c in criterions:
         c.to(device)
 
@@ -108,18 +120,22 @@ def train_model(args, device, parallel):
         train_loader = DataLoader(data_loader.get_loader(
             args[ds_cfg]['data_dir'], args[ds_cfg]['train_file'], transforms=tsfm_train,
             n_class=args[ds_cfg]['class_num'], with_aux=with_aux),
-            batch_size=int(args[ds_cfg]['batch_size']), shuffle=True, num_workers=int(args['dataset']['num_workers']),
-            drop_last=True)
+            batch_size=int(args[ds_cfg]['batch_size']), shuffle=True, drop_last=True,
+            **get_loader_kwargs(int(args['dataset']['num_workers'])))
         train_val_loaders['train'].append(train_loader)
 
         if 'valid_file' in args[ds_cfg]:
             valid_loader = DataLoader (data_loader.get_loader(
                 args[ds_cfg]['data_dir'], args[ds_cfg]['valid_file'], transforms=tsfm_valid,
                 n_class=args[ds_cfg]['class_num'], with_aux=with_aux),
-                batch_size=int(args[ds_cfg]['batch_size']), shuffle=False, num_workers=int(args[ds_cfg]['num_workers']))
+                batch_size=int(args[ds_cfg]['batch_size']), shuffle=False,
+                **get_loader_kwargs(int(args[ds_cfg]['num_workers'])))
             print('Training model on the {} dataset'.format(args[ds_cfg]['ds_name']))
             train_val_loaders['valid'].append(valid_loader)
 
+    # make infi-loop data loaders for mixed batches once, so that they carry on across epochs
+    train_loader_others = [network_utils.infi_loop_loader(dl) for dl in train_val_loaders['train'][1:]]
+
     # train the model
     loss_dict = {}
     for epoch in range(int(args['trainer']['resume_epoch']), int(args['trainer']['epochs'])):
@@ -136,7 +152,9 @@ def train_model(args, device, parallel):
                                    eval(args['trainer']['bp_loss_idx']), True, mean, std,
                                    loss_weights=eval(args['trainer']['loss_weights']), use_emau=args['use_emau'],
                                    use_ocr=args['use_ocr'], cls_criterion=cls_criterion,
-                                   cls_weight=args['optimizer']['aux_loss_weight'])
+                                   cls_weight=args['optimizer']['aux_loss_weight'],
+                                   use_amp=args['trainer']['use_amp'],
+                                   data_loader_others=train_loader_others if phase == 'train' else None)
             network_utils.write_and_print(writer, phase, epoch, int(args['trainer']['epochs']), loss_dict, start_time)
 
         scheduler.step()